@@ -7,6 +7,7 @@ import (
 	"io"
 	"mime"
 	"net/http"
+	"net/url"
 	"os"
 	"path/filepath"
 	"strings"
@@ -69,6 +70,17 @@ func (s *DownloadService) Download(req *model.DownloadRequest) (*model.DownloadR
 		return nil, fmt.Errorf("download failed with status %d", resp.StatusCode)
 	}
 
+	// Python worker shares the download directory; X-Sendfile names the file it
+	// already wrote there (percent-encoded), so track it in place instead of copying the body
+	if sendfile := resp.Header.Get("X-Sendfile"); sendfile != "" {
+		sendfilePath, err := url.PathUnescape(sendfile)
+		if err != nil {
+			logger.Logger.Error("Invalid X-Sendfile header", zap.Error(err), zap.String("x_sendfile", sendfile))
+			return nil, fmt.Errorf("invalid X-Sendfile header: %w", err)
+		}
+		return s.trackSentFile(req, filepath.Base(sendfilePath))
+	}
+
 	// Try to read Python worker response (may include filename in JSON)
 	var pythonResponse *model.PythonWorkerDownloadResponse
 	var filename string
@@ -141,12 +153,40 @@ func (s *DownloadService) Download(req *model.DownloadRequest) (*model.DownloadR
 		zap.String("filename", filename),
 		zap.Int64("size_bytes", int64(len(fileDataBytes))))
 
+	return s.trackFile(req, filename, downloadPath, int64(len(fileDataBytes)))
+}
+
+// trackSentFile tracks a file the Python worker wrote into the shared download directory
+func (s *DownloadService) trackSentFile(req *model.DownloadRequest, filename string) (*model.DownloadResponse, error) {
+	downloadPath := s.storageManager.GetDownloadPath(filename)
+	info, err := os.Stat(downloadPath)
+	if err != nil {
+		logger.Logger.Error("X-Sendfile target not found", zap.Error(err), zap.String("path", downloadPath))
+		return nil, fmt.Errorf("downloaded file not found: %w", err)
+	}
+
+	// Validate file size
+	if !s.storageManager.ValidateFileSize(info.Size()) {
+		logger.Logger.Warn("File size exceeds limit", zap.String("filename", filename), zap.Int64("size", info.Size()))
+		os.Remove(downloadPath)
+		return nil, fmt.Errorf("file size exceeds maximum limit of %dMB", 300)
+	}
+
+	logger.Logger.Info("Download from Python worker completed via X-Sendfile",
+		zap.String("filename", filename),
+		zap.Int64("size_bytes", info.Size()))
+
+	return s.trackFile(req, filename, downloadPath, info.Size())
+}
+
+// trackFile registers a downloaded file with the storage manager and builds the response
+func (s *DownloadService) trackFile(req *model.DownloadRequest, filename, downloadPath string, size int64) (*model.DownloadResponse, error) {
 	// Generate download response
 	downloadID := fmt.Sprintf("%d", time.Now().UnixNano())
 	file := &model.DownloadedFile{
 		Filename: filename,
 		FilePath: downloadPath,
-		Size:     int64(len(fileDataBytes)),
+		Size:     size,
 		URL:      req.URL,
 	}
 
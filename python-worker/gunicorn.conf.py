@@ -0,0 +1,15 @@
+"""Gunicorn hooks for the yt-dlp worker (read from ./gunicorn.conf.py by default)"""
+import itertools
+
+
+def pre_fork(server, worker):
+    """Give the new worker the lowest slot not held by a live worker, so a respawned
+    worker takes over its predecessor's slot"""
+    taken = {getattr(w, 'slot', None) for w in server.WORKERS.values()}
+    worker.slot = next(slot for slot in itertools.count() if slot not in taken)
+
+
+def post_fork(server, worker):
+    """Log to the slot's file, so the set of log files stays fixed across respawns"""
+    import worker as app_module
+    app_module.set_log_file(f'worker-{worker.slot}')
@@ -4,534 +4,776 @@ Python worker service for yt-dlp integration
 Handles video metadata extraction and downloading
 """
 
-from flask import Flask, request, jsonify, send_file
+from fastapi import FastAPI
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, FileResponse, Response
+from pydantic import BaseModel
+from cachelib import SimpleCache, RedisCache
 import yt_dlp
 import os
+import asyncio
+import atexit
 import logging
 import json
-from functools import wraps
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import traceback
 from datetime import datetime
-import subprocess
+from urllib.parse import quote, urlsplit
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max
+# Initialize FastAPI app
+app = FastAPI(title='yt-dlp-worker', default_response_class=ORJSONResponse)
 
 # Configure logging
 log_dir = './log'
 os.makedirs(log_dir, exist_ok=True)
 
-logging.basicConfig(
-    level=os.getenv('LOG_LEVEL', 'INFO'),
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, 'worker.log')),
-        logging.StreamHandler()
-    ]
-)
+# Handlers run on a listener thread so request handlers only enqueue records
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+
+def make_log_file_handler(name='worker'):
+    """Create a rotating handler on log/<name>.log
+    Rotation is not safe across processes, so each gunicorn worker slot gets its own file"""
+    handler = RotatingFileHandler(
+        f'{log_dir}/{name}.log',
+        maxBytes=int(os.getenv('LOG_ROTATION_SIZE', 10 * 1024 * 1024)),
+        backupCount=int(os.getenv('LOG_MAX_BACKUPS', 5)),
+        encoding='utf-8',
+        delay=True  # Don't create a file for processes that never log (e.g. the gunicorn master)
+    )
+    handler.setFormatter(log_formatter)
+    return handler
+
+
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+
+queue_handler = QueueHandler(queue.Queue(-1))
+log_listener = QueueListener(queue_handler.queue, make_log_file_handler(), stream_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+
+def set_log_file(name=None):
+    """Send this process's file logging to log/<name>.log, or log to stderr only if name is None"""
+    old_handlers = log_listener.handlers
+    log_listener.handlers = (make_log_file_handler(name), stream_handler) if name else (stream_handler,)
+    for handler in old_handlers:
+        if handler is not stream_handler:
+            handler.close()
+
+
+def restart_log_listener():
+    """Give a forked worker (gunicorn --preload) its own queue and listener thread
+    It logs to stderr only until gunicorn's post_fork hook assigns its slot's log file"""
+    set_log_file(None)
+    queue_handler.queue = log_listener.queue = queue.Queue(-1)
+    log_listener.start()
+
+
+os.register_at_fork(after_in_child=restart_log_listener)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+root_logger.addHandler(queue_handler)
 logger = logging.getLogger(__name__)
 
 # Configuration
 DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', './downloads')
+# Linux-only service: build download paths by plain concatenation instead of os.path.join
+DOWNLOAD_PREFIX = DOWNLOAD_DIR.rstrip('/') + '/'
 MAX_VIDEO_SIZE_MB = int(os.getenv('MAX_VIDEO_SIZE_MB', 300))
 ALLOWED_DOMAINS = os.getenv('ALLOWED_DOMAINS', 'youtube.com,youtu.be,vimeo.com,facebook.com,m.facebook.com,fb.watch,tiktok.com,instagram.com,twitter.com,x.com').split(',')
 MAX_FILENAME_LENGTH = int(os.getenv('MAX_FILENAME_LENGTH', 200))
+# Byte caps that keep the quality suffix from eating the whole title budget
+MAX_QUALITY_SUFFIX_BYTES = 32
+MIN_TITLE_BYTES = 16
+INFO_CACHE_TTL = int(os.getenv('INFO_CACHE_TTL', 300))
+MAX_FFMPEG_JOBS = int(os.getenv('MAX_FFMPEG_JOBS', os.cpu_count() or 1))
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', 4))
+DOWNLOAD_QUEUE_SIZE = int(os.getenv('DOWNLOAD_QUEUE_SIZE', 16))
+USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+MAX_BATCH_URLS = int(os.getenv('MAX_BATCH_URLS', 50))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 16))
+BATCH_CONCURRENCY_PER_HOST = int(os.getenv('BATCH_CONCURRENCY_PER_HOST', 4))
+YTDLP_CACHE_DIR = os.getenv('YTDLP_CACHE_DIR', './cache')
+YTDLP_COOKIE_FILE = os.getenv('YTDLP_COOKIE_FILE', '')
+
+CACHE_TYPE = os.getenv('CACHE_TYPE', 'SimpleCache')
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# Cache extracted video info so repeated lookups of the same URL skip yt-dlp
+if CACHE_TYPE == 'RedisCache':
+    import redis
+    cache = RedisCache(host=redis.Redis.from_url(CACHE_REDIS_URL), default_timeout=INFO_CACHE_TTL, key_prefix='ytdlp-worker:')
+else:
+    cache = SimpleCache(default_timeout=INFO_CACHE_TTL)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+BASE_YDL_OPTIONS = {
+    'quiet': False,
+    'no_warnings': False,
+    'extract_flat': False,
+    'noplaylist': True,
+    'socket_timeout': 30,
+    # Persist yt-dlp's cache (e.g. deciphered YouTube player signatures) across extractions
+    'cachedir': YTDLP_CACHE_DIR,
+    'http_headers': {
+        'User-Agent': USER_AGENT,
+        'Accept-Language': 'en-US,en;q=0.9'
+    }
+}
+
+# Reuse a logged-in session when a cookies.txt file is provided
+if YTDLP_COOKIE_FILE:
+    BASE_YDL_OPTIONS['cookiefile'] = YTDLP_COOKIE_FILE
+
+@dataclass(frozen=True)
+class SiteConfig:
+    """yt-dlp settings for a video site, identified by its unique name"""
+    name: str
+    referer: str = ''
+    options: dict = field(default_factory=dict)
+
+
+def match_domain(host, domains):
+    """Return the entry of domains equal to host or one of its parent domains, or None"""
+    while host:
+        if host in domains:
+            return host
+        # Drop the leftmost label (www., m., vt., ...) and try the parent domain
+        host = host.partition('.')[2]
+    return None
+
+
+# Options shared by TikTok, Instagram and Twitter/X
+SOCIAL_YDL_OPTIONS = {
+    'quiet': False,
+    'no_warnings': False,
+    'socket_timeout': 60,
+    'retries': 3,
+    'skip_unavailable_fragments': True,
+    'format_sort': ['res', 'fps']
+}
+
+DEFAULT_SITE = SiteConfig('default')
+FACEBOOK_SITE = SiteConfig('facebook', 'https://www.facebook.com/', {
+    'quiet': True,
+    'no_warnings': True,
+    'format_sort': ['res', 'fps', 'codec:h264', 'lang'],
+    'fragment_retries': 3,
+    'skip_unavailable_fragments': True,
+})
+TWITTER_SITE = SiteConfig('twitter', 'https://twitter.com/', SOCIAL_YDL_OPTIONS)
+
+# Site-specific settings, keyed by domain (subdomains resolve to their parent)
+SITE_CONFIGS = {
+    'facebook.com': FACEBOOK_SITE,
+    'fb.watch': FACEBOOK_SITE,
+    'tiktok.com': SiteConfig('tiktok', 'https://www.tiktok.com/', SOCIAL_YDL_OPTIONS),
+    'instagram.com': SiteConfig('instagram', 'https://www.instagram.com/', SOCIAL_YDL_OPTIONS),
+    'twitter.com': TWITTER_SITE,
+    'x.com': TWITTER_SITE,
+}
+
+# Allowed domain -> site config; the single table behind both URL validation and yt-dlp options
+DOMAIN_TABLE = {
+    domain: SITE_CONFIGS.get(match_domain(domain, SITE_CONFIGS), DEFAULT_SITE)
+    for domain in (d.strip().lower() for d in ALLOWED_DOMAINS)
+    if domain
+}
+
+# Site configs by name, the key build_ydl_options caches on
+SITES_BY_NAME = {site.name: site for site in (DEFAULT_SITE, *DOMAIN_TABLE.values())}
+
+# Storyboard and image formats are never offered for download
+SKIP_EXTS = frozenset(('mhtml', 'jpg', 'jpeg', 'png', 'gif', 'webp'))
+
+# In-flight info extractions by URL (see extract_info_shared)
+inflight_extractions = {}
+
+# Bound the number of ffmpeg processes running at once
+FFMPEG_SEMAPHORE = asyncio.Semaphore(MAX_FFMPEG_JOBS)
+
+# Run yt-dlp downloads on a bounded pool; requests beyond pool + queue are rejected
+DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix='download')
+DOWNLOAD_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_DOWNLOADS + DOWNLOAD_QUEUE_SIZE)
 
 # Ensure download directory exists
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-os.makedirs('./log', exist_ok=True)
+os.makedirs(YTDLP_CACHE_DIR, exist_ok=True)
+
+
+class InfoRequest(BaseModel):
+    """Request body for /api/info"""
+    url: str
+
+
+class BatchInfoRequest(BaseModel):
+    """Request body for /api/info/batch"""
+    urls: list[str]
+
+
+class DownloadRequest(BaseModel):
+    """Request body for /api/download"""
+    url: str
+    format_id: str
+    quality: str = 'Unknown'
+
+
+class FileTooLargeError(yt_dlp.utils.DownloadCancelled):
+    """Raised by size_guard to abort a download that exceeds MAX_VIDEO_SIZE_MB"""
+    msg = f'File size exceeds maximum limit of {MAX_VIDEO_SIZE_MB}MB'
+    
+    def __init__(self, partial_file=None):
+        super().__init__()
+        self.partial_file = partial_file
+
+
+class VideoFileResponse(FileResponse):
+    """FileResponse reading large video files in 1MB chunks instead of 64KB"""
+    chunk_size = 1024 * 1024
 
 
 def error_handler(f):
     """Decorator for handling errors in API endpoints"""
     @wraps(f)
-    def decorated(*args, **kwargs):
+    async def decorated(*args, **kwargs):
         try:
-            return f(*args, **kwargs)
+            return await f(*args, **kwargs)
         except Exception as e:
             logger.error(f"Error in {f.__name__}: {str(e)}\n{traceback.format_exc()}")
-            return jsonify({
+            return ORJSONResponse(status_code=500, content={
                 'error': 'server_error',
                 'message': str(e),
                 'code': 500
-            }), 500
+            })
     return decorated
 
 
+def memoize(timeout):
+    """Decorator caching a function's result per positional arguments"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args):
+            key = f"{f.__name__}:{':'.join(str(arg) for arg in args)}"
+            value = cache.get(key)
+            if value is None:
+                value = f(*args)
+                cache.set(key, value, timeout=timeout)
+            return value
+        return decorated
+    return decorator
+
+
+def url_domain(url):
+    """Return the DOMAIN_TABLE key matching the URL host, or None if it is not allowed"""
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    return match_domain(host or '', DOMAIN_TABLE)
+
+
 def validate_url(url):
-    """Validate if URL is from allowed domain"""
-    for domain in ALLOWED_DOMAINS:
-        if domain.strip() in url:
-            return True
-    return False
+    """Validate if URL host is an allowed domain or one of its subdomains"""
+    return url_domain(url) is not None
 
 
-def truncate_filename(filename, max_length):
-    """Truncate filename to max length while preserving extension
-    Uses proper Unicode handling to avoid breaking multi-byte characters"""
-    if len(filename) <= max_length:
+def truncate_filename(filename, max_bytes):
+    """Truncate filename to max_bytes of UTF-8 while preserving extension
+    Cuts on a character boundary so multi-byte characters are never split"""
+    encoded = filename.encode('utf-8')
+    if len(encoded) <= max_bytes:
         return filename
     
-    # Find the extension
-    last_dot = filename.rfind('.')
-    if last_dot == -1:
-        # No extension, just truncate
-        return filename[:max_length]
+    base_name, ext = os.path.splitext(filename)
+    ext_len = len(ext.encode('utf-8'))
+    if ext_len >= max_bytes:
+        # Extension is too long (or there is none to keep room for), just truncate everything
+        return encoded[:max_bytes].decode('utf-8', 'ignore')
     
-    ext = filename[last_dot:]
-    base_name = filename[:last_dot]
-    
-    # Calculate available space for base name (using character count, not bytes)
-    available_len = max_length - len(ext)
-    if available_len <= 0:
-        # Extension is too long, just truncate everything
-        return filename[:max_length]
-    
-    # Truncate base name and add extension
-    return base_name[:available_len] + ext
+    # Truncate base name by bytes; 'ignore' drops a trailing partial character
+    return base_name.encode('utf-8')[:max_bytes - ext_len].decode('utf-8', 'ignore') + ext
+
+
+@lru_cache(maxsize=16)
+def build_ydl_options(site_name):
+    """Build yt-dlp options for a site (cached per site name)"""
+    site = SITES_BY_NAME[site_name]
+    options = {**BASE_YDL_OPTIONS, **site.options}
+    options['http_headers'] = dict(BASE_YDL_OPTIONS['http_headers'])
+    if site.referer:
+        options['http_headers']['Referer'] = site.referer
+    return options
 
 
 def get_ydl_options(video_url):
     """Get yt-dlp options based on video source"""
-    user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    
-    base_options = {
-        'quiet': False,
-        'no_warnings': False,
-        'extract_flat': False,
-        'noplaylist': True,
-        'socket_timeout': 30,
-        'http_headers': {
-            'User-Agent': user_agent,
-            'Accept-Language': 'en-US,en;q=0.9'
-        }
-    }
-    
-    # Facebook-specific options
-    if 'facebook.com' in video_url or 'fb.watch' in video_url or 'm.facebook.com' in video_url:
-        base_options.update({
-            'http_headers': {
-                'User-Agent': user_agent,
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': 'https://www.facebook.com/'
-            },
-            'quiet': True,
-            'no_warnings': True,
-            'format_sort': ['res', 'fps', 'codec:h264', 'lang'],
-            'fragment_retries': 3,
-            'skip_unavailable_fragments': True,
-        })
-    
-    # TikTok-specific options
-    elif 'tiktok.com' in video_url or 'vt.tiktok.com' in video_url or 'm.tiktok.com' in video_url:
-        base_options.update({
-            'http_headers': {
-                'User-Agent': user_agent,
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': 'https://www.tiktok.com/'
-            },
-            'quiet': False,
-            'no_warnings': False,
-            'socket_timeout': 60,
-            'retries': 3,
-            'skip_unavailable_fragments': True,
-            'format_sort': ['res', 'fps']
-        })
+    options = build_ydl_options(DOMAIN_TABLE.get(url_domain(video_url), DEFAULT_SITE).name)
+    # Return a copy so callers can adjust options without touching the cached dict
+    return {**options, 'http_headers': dict(options['http_headers'])}
+
+
+def format_entry(fmt, skip_codecless=True):
+    """Build the API entry for a yt-dlp format, or None if it should be skipped"""
+    get = fmt.get
+    ext = get('ext') or ''
+    vcodec = get('vcodec', 'none')
+    acodec = get('acodec', 'none')
     
-    # Instagram-specific options
-    elif 'instagram.com' in video_url or 'instagram.com' in video_url:
-        base_options.update({
-            'http_headers': {
-                'User-Agent': user_agent,
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': 'https://www.instagram.com/'
-            },
-            'quiet': False,
-            'no_warnings': False,
-            'socket_timeout': 60,
-            'retries': 3,
-            'skip_unavailable_fragments': True,
-            'format_sort': ['res', 'fps']
-        })
+    # Skip storyboard/image formats and, optionally, formats with unknown codecs
+    if not ext or ext in SKIP_EXTS or (skip_codecless and vcodec == 'none' and acodec == 'none'):
+        return None
     
-    # Twitter/X-specific options
-    elif 'twitter.com' in video_url or 'x.com' in video_url:
-        base_options.update({
-            'http_headers': {
-                'User-Agent': user_agent,
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': 'https://twitter.com/'
-            },
-            'quiet': False,
-            'no_warnings': False,
-            'socket_timeout': 60,
-            'retries': 3,
-            'skip_unavailable_fragments': True,
-            'format_sort': ['res', 'fps']
-        })
+    return {
+        'format_id': get('format_id', ''),
+        'ext': ext,
+        'resolution': get('resolution', 'unknown'),
+        'vcodec': vcodec,
+        'acodec': acodec,
+        'filesize': get('filesize') or 0,
+        'fps': get('fps') or 0,
+        'format': get('format', ''),
+    }
+
+
+def filter_formats(info_formats, skip_codecless=True):
+    """Convert yt-dlp formats into API entries, dropping unusable ones"""
+    return [entry for entry in (format_entry(fmt, skip_codecless) for fmt in info_formats) if entry]
+
+
+def fetch_info(video_url, ydl_opts):
+    """Extract video metadata without downloading"""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(video_url, download=False)
+        # Strip non-serializable internals so the result can be cached
+        return ydl.sanitize_info(info)
+
+
+@memoize(INFO_CACHE_TTL)
+def extract_info(video_url):
+    """Extract video metadata without downloading (cached per URL)"""
+    ydl_opts = get_ydl_options(video_url)
+    ydl_opts['skip_download'] = True
+    return fetch_info(video_url, ydl_opts)
+
+
+async def extract_info_shared(video_url):
+    """Run extract_info in a thread, sharing one extraction among concurrent callers for a URL"""
+    task = inflight_extractions.get(video_url)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(extract_info, video_url))
+        inflight_extractions[video_url] = task
+        task.add_done_callback(lambda _: inflight_extractions.pop(video_url, None))
+    # Shield so one caller disconnecting does not cancel the extraction for the others
+    return await asyncio.shield(task)
+
+
+def size_guard(d):
+    """yt-dlp progress hook aborting downloads as soon as they exceed the size limit"""
+    if (d.get('downloaded_bytes') or 0) > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        raise FileTooLargeError(d.get('tmpfilename'))
+
+
+def run_download(video_url, ydl_opts, format_spec):
+    """Download the video with yt-dlp and return the path of the downloaded file"""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        try:
+            info = ydl.extract_info(video_url, download=True)
+        except yt_dlp.utils.DownloadCancelled:
+            raise
+        except Exception as format_error:
+            # If format fails (common with Facebook), try best format
+            logger.warning(f"Format {format_spec} failed, retrying with best available format: {str(format_error)}")
+            ydl_opts['format'] = 'best'  # Fallback to best available
+            info = ydl.extract_info(video_url, download=True)
     
-    return base_options
+    # Get the downloaded file path (DOWNLOAD_DIR included via outtmpl) from yt-dlp
+    return ydl.prepare_filename(info)
 
 
-@app.route('/health', methods=['GET'])
-def health_check():
+@app.get('/health')
+async def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return {
         'status': 'healthy',
         'service': 'yt-dlp-worker',
         'timestamp': datetime.now().isoformat()
-    }), 200
+    }
 
 
-@app.route('/api/info', methods=['POST'])
+@app.post('/api/info')
 @error_handler
-def get_video_info():
+async def get_video_info(data: InfoRequest):
     """Get video information from URL"""
-    data = request.get_json()
-    
-    if not data or 'url' not in data:
-        return jsonify({
-            'error': 'invalid_request',
-            'message': 'URL is required',
-            'code': 400
-        }), 400
-    
-    video_url = data['url']
+    video_url = data.url
     
     # Validate URL domain
     if not validate_url(video_url):
         logger.warning(f"Domain not allowed: {video_url}")
-        return jsonify({
+        return ORJSONResponse(status_code=400, content={
             'error': 'invalid_domain',
             'message': 'Domain is not allowed',
             'code': 400
-        }), 400
+        })
     
     logger.info(f"Fetching info for URL: {video_url}")
     
     try:
-        ydl_opts = get_ydl_options(video_url)
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            
-            # Process formats
-            formats = []
-            if 'formats' in info:
-                for fmt in info['formats']:
-                    # Skip storyboard and image formats
-                    ext = fmt.get('ext', '')
-                    if ext in ('mhtml', 'jpg', 'jpeg', 'png', 'gif', 'webp'):
-                        continue
-                    
-                    # Get video/audio info
-                    vcodec = fmt.get('vcodec', 'none')
-                    acodec = fmt.get('acodec', 'none')
-                    
-                    # Skip if only has unknown codecs and no extension  
-                    if not ext or (vcodec == 'none' and acodec == 'none'):
-                        continue
-                    
-                    format_info = {
-                        'format_id': fmt.get('format_id', ''),
-                        'ext': ext,
-                        'resolution': fmt.get('resolution', 'unknown'),
-                        'vcodec': vcodec,
-                        'acodec': acodec,
-                        'filesize': fmt.get('filesize', 0),
-                        'fps': fmt.get('fps', 0),
-                        'format': fmt.get('format', ''),
-                    }
-                    formats.append(format_info)
-            
-            # If no formats found, try to fetch them again with different options  
-            if not formats:
-                logger.warning(f"No formats found for {video_url}, retrying with different options...")
-                retry_opts = get_ydl_options(video_url)
-                retry_opts['skip_unavailable_fragments'] = False
-                with yt_dlp.YoutubeDL(retry_opts) as ydl:
-                    info = ydl.extract_info(video_url, download=False)
-                    if 'formats' in info:
-                        for fmt in info['formats']:
-                            if fmt.get('ext') and fmt.get('ext') not in ('mhtml', 'jpg', 'jpeg', 'png', 'gif', 'webp'):
-                                format_info = {
-                                    'format_id': fmt.get('format_id', ''),
-                                    'ext': fmt.get('ext', ''),
-                                    'resolution': fmt.get('resolution', 'unknown'),
-                                    'vcodec': fmt.get('vcodec', 'none'),
-                                    'acodec': fmt.get('acodec', 'none'),
-                                    'filesize': fmt.get('filesize', 0),
-                                    'fps': fmt.get('fps', 0),
-                                    'format': fmt.get('format', ''),
-                                }
-                                formats.append(format_info)
-            
-            response = {
-                'id': info.get('id', ''),
-                'title': info.get('title', 'Unknown'),
-                'duration': info.get('duration', 0),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', 'Unknown'),
-                'url': video_url,
-                'formats': formats
-            }
-            
-            logger.info(f"Successfully fetched info. Formats: {len(formats)}")
-            return jsonify(response), 200
-            
+        response = await build_video_info(video_url)
+        logger.info(f"Successfully fetched info. Formats: {len(response['formats'])}")
+        return response
+        
     except Exception as e:
         logger.error(f"Failed to fetch video info: {str(e)}")
-        return jsonify({
+        return ORJSONResponse(status_code=400, content={
             'error': 'fetch_failed',
             'message': f"Failed to fetch video information: {str(e)}",
             'code': 400
-        }), 400
+        })
 
 
-def get_format_with_audio(base_format_id, video_url):
+@app.post('/api/info/batch')
+@error_handler
+async def get_batch_video_info(data: BatchInfoRequest):
+    """Get video information for several URLs concurrently"""
+    if len(data.urls) > MAX_BATCH_URLS:
+        return ORJSONResponse(status_code=400, content={
+            'error': 'invalid_request',
+            'message': f'At most {MAX_BATCH_URLS} URLs are allowed per batch',
+            'code': 400
+        })
+    
+    logger.info(f"Fetching info for {len(data.urls)} URLs")
+    
+    # Bound total concurrency, and concurrency per domain to avoid tripping site rate limits
+    batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    domain_semaphores = {}
+    
+    async def fetch_one(video_url):
+        if not validate_url(video_url):
+            return {
+                'error': 'invalid_domain',
+                'message': 'Domain is not allowed',
+                'code': 400,
+                'url': video_url
+            }
+        
+        domain = url_domain(video_url)
+        domain_semaphore = domain_semaphores.setdefault(domain, asyncio.Semaphore(BATCH_CONCURRENCY_PER_HOST))
+        try:
+            async with batch_semaphore, domain_semaphore:
+                return await build_video_info(video_url)
+        except Exception as e:
+            logger.error(f"Failed to fetch video info for {video_url}: {str(e)}")
+            return {
+                'error': 'fetch_failed',
+                'message': f"Failed to fetch video information: {str(e)}",
+                'code': 400,
+                'url': video_url
+            }
+    
+    results = await asyncio.gather(*(fetch_one(video_url) for video_url in data.urls))
+    return {'results': results}
+
+
+async def build_video_info(video_url):
+    """Extract video info and build the /api/info response for a URL"""
+    info = await extract_info_shared(video_url)
+    
+    # Process formats
+    formats = filter_formats(info.get('formats') or ())
+    
+    # If no formats found, try to fetch them again with different options  
+    if not formats:
+        logger.warning(f"No formats found for {video_url}, retrying with different options...")
+        retry_opts = get_ydl_options(video_url)
+        retry_opts['skip_unavailable_fragments'] = False
+        info = await asyncio.to_thread(fetch_info, video_url, retry_opts)
+        formats = filter_formats(info.get('formats') or (), skip_codecless=False)
+    
+    return {
+        'id': info.get('id', ''),
+        'title': info.get('title', 'Unknown'),
+        'duration': info.get('duration', 0),
+        'thumbnail': info.get('thumbnail', ''),
+        'uploader': info.get('uploader', 'Unknown'),
+        'url': video_url,
+        'formats': formats
+    }
+
+
+def get_format_with_audio(base_format_id, info_formats):
     """
     Construct format string to ensure audio is included
     For video-only formats, merge with best audio: "format_id+bestaudio"
     """
-    # First, try to get format info to check if it has audio
-    try:
-        ydl_opts = get_ydl_options(video_url)
-        ydl_opts['skip_download'] = True
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
+    # Find the selected format among the already-extracted formats
+    for fmt in info_formats:
+        if fmt.get('format_id') == base_format_id:
+            acodec = fmt.get('acodec', 'none')
+            vcodec = fmt.get('vcodec', 'none')
             
-            # Find the selected format
-            if 'formats' in info:
-                for fmt in info['formats']:
-                    if fmt.get('format_id') == base_format_id:
-                        acodec = fmt.get('acodec', 'none')
-                        vcodec = fmt.get('vcodec', 'none')
-                        
-                        # If format has no audio but has video, merge with audio
-                        if acodec == 'none' and vcodec != 'none':
-                            logger.info(f"Format {base_format_id} has no audio, merging with best audio")
-                            return f"{base_format_id}+bestaudio/best"
-                        # If format has audio, use it as-is
-                        elif acodec != 'none':
-                            logger.info(f"Format {base_format_id} has audio, using as-is")
-                            return base_format_id
-                        # If format is audio-only or unknown
-                        else:
-                            logger.info(f"Format {base_format_id} is audio-only or unknown, using as-is")
-                            return base_format_id
-            
-            # If format not found in list, try merging anyway
-            logger.warning(f"Could not determine format {base_format_id} type, attempting merge with audio")
-            return f"{base_format_id}+bestaudio/best"
-    except Exception as e:
-        logger.warning(f"Error checking format type: {str(e)}, using format as-is")
-        return base_format_id
+            # If format has no audio but has video, merge with audio
+            if acodec == 'none' and vcodec != 'none':
+                logger.info(f"Format {base_format_id} has no audio, merging with best audio")
+                return f"{base_format_id}+bestaudio/best"
+            # If format has audio, use it as-is
+            elif acodec != 'none':
+                logger.info(f"Format {base_format_id} has audio, using as-is")
+                return base_format_id
+            # If format is audio-only or unknown
+            else:
+                logger.info(f"Format {base_format_id} is audio-only or unknown, using as-is")
+                return base_format_id
+    
+    # If format not found in list, try merging anyway
+    logger.warning(f"Could not determine format {base_format_id} type, attempting merge with audio")
+    return f"{base_format_id}+bestaudio/best"
 
 
-@app.route('/api/download', methods=['POST'])
-@error_handler
-def download_video():
-    """Download video with specified format"""
-    data = request.get_json()
+def get_format_ext(format_id, info_formats, default='mp4'):
+    """Get the extension of the selected format from the extracted formats"""
+    for fmt in info_formats:
+        if fmt.get('format_id') == format_id:
+            return fmt.get('ext', default)
+    return default
+
+
+def build_output_template(info, quality_suffix, target_ext):
+    """Build the yt-dlp output template for a download: the sanitized title truncated to
+    MAX_FILENAME_LENGTH bytes, the quality suffix, and %(ext)s filled in by yt-dlp"""
+    # Bound the client-supplied suffix so the title always keeps some room
+    quality_suffix = yt_dlp.utils.sanitize_filename(quality_suffix)
+    quality_suffix = quality_suffix.encode('utf-8')[:MAX_QUALITY_SUFFIX_BYTES].decode('utf-8', 'ignore')
     
-    if not data or 'url' not in data or 'format_id' not in data:
-        return jsonify({
-            'error': 'invalid_request',
-            'message': 'URL and format_id are required',
-            'code': 400
-        }), 400
+    if info is None:
+        # No extracted info to name the file from; fall back to the (short) video id
+        return DOWNLOAD_PREFIX.replace('%', '%%') + '%(id)s' + quality_suffix.replace('%', '%%') + '.%(ext)s'
+    
+    # Sanitize the title the way yt-dlp does for %(title)s, then truncate the sanitized name by bytes
+    title = yt_dlp.utils.sanitize_filename(info.get('title') or 'NA')
+    budget = max(MAX_FILENAME_LENGTH - len(quality_suffix.encode('utf-8')), len(target_ext) + 1 + MIN_TITLE_BYTES)
+    base_name = os.path.splitext(truncate_filename(f'{title}.{target_ext}', budget))[0]
     
-    video_url = data['url']
-    format_id = data['format_id']
-    quality = data.get('quality', 'Unknown')  # Get quality label from request
+    # Escape % so the name is taken literally; only the extension is left to yt-dlp
+    return f'{DOWNLOAD_PREFIX}{base_name}{quality_suffix}'.replace('%', '%%') + '.%(ext)s'
+
+
+def get_format_size(format_id, info_formats):
+    """Get the known or approximate size in bytes of the selected format (0 if unknown)"""
+    for fmt in info_formats:
+        if fmt.get('format_id') == format_id:
+            return fmt.get('filesize') or fmt.get('filesize_approx') or 0
+    return 0
+
+
+@app.post('/api/download')
+@error_handler
+async def download_video(data: DownloadRequest):
+    """Download video with specified format"""
+    video_url = data.url
+    format_id = data.format_id
+    quality = data.quality  # Get quality label from request
     
     # Validate URL
     if not validate_url(video_url):
         logger.warning(f"Domain not allowed for download: {video_url}")
-        return jsonify({
+        return ORJSONResponse(status_code=400, content={
             'error': 'invalid_domain',
             'message': 'Domain is not allowed',
             'code': 400
-        }), 400
+        })
+    
+    # Reject instead of piling up when the download pool and its queue are full
+    if not DOWNLOAD_SLOTS.acquire(blocking=False):
+        logger.warning(f"Download queue full, rejecting: {video_url}")
+        return ORJSONResponse(status_code=503, content={
+            'error': 'server_busy',
+            'message': 'Too many downloads in progress, please try again later',
+            'code': 503
+        })
     
     logger.info(f"Starting download. URL: {video_url}, Format: {format_id}, Quality: {quality}")
     
     try:
         ydl_opts = get_ydl_options(video_url)
         
+        # Extract formats once and reuse them for the audio-merge and extension checks
+        info = None
+        info_formats = None
+        try:
+            info = await extract_info_shared(video_url)
+            info_formats = info.get('formats') or []
+        except Exception as e:
+            logger.warning(f"Error checking format type: {str(e)}, using format as-is")
+        
         # Get format with audio merging if needed
-        format_spec = get_format_with_audio(format_id, video_url)
+        format_spec = get_format_with_audio(format_id, info_formats) if info_formats is not None else format_id
         
         # Determine if this is a merge operation
         is_merge = '+' in format_spec
         
         # Get format info to determine target extension
-        target_ext = 'mp4'  # default
-        try:
-            ydl_test = get_ydl_options(video_url)
-            ydl_test['skip_download'] = True
-            with yt_dlp.YoutubeDL(ydl_test) as ydl:
-                info = ydl.extract_info(video_url, download=False)
-                if 'formats' in info:
-                    for fmt in info['formats']:
-                        if fmt.get('format_id') == format_id:
-                            target_ext = fmt.get('ext', 'mp4')
-                            break
-        except:
-            pass
+        target_ext = get_format_ext(format_id, info_formats or [])
+        
+        # Reject formats already known to exceed the size limit before downloading anything
+        known_size = get_format_size(format_id, info_formats or [])
+        if known_size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+            logger.warning(f"Format {format_id} size exceeds limit: {known_size} bytes")
+            return ORJSONResponse(status_code=400, content={
+                'error': 'file_too_large',
+                'message': f'File size exceeds maximum limit of {MAX_VIDEO_SIZE_MB}MB',
+                'code': 400
+            })
         
         # Set quality suffix for filename
         quality_suffix = f"_{quality}" if quality and quality != 'Unknown' else ""
         
+        # Build the final filename up front so yt-dlp writes the file under its final name
+        outtmpl = build_output_template(info, quality_suffix, target_ext)
+        
         ydl_opts.update({
             'format': format_spec,
-            'outtmpl': os.path.join(DOWNLOAD_DIR, '%(title)s.%(ext)s'),  # No quality suffix in template
+            'outtmpl': outtmpl,
             'socket_timeout': 60,
             'noplaylist': True,
             'postprocessors': [],
+            # Abort downloads whose size was unknown up front once they grow too large
+            'progress_hooks': [size_guard],
         })
         
         # Download the video
         logger.debug(f"Starting yt-dlp download with format: {format_spec}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(video_url, download=True)
-            except Exception as format_error:
-                # If format fails (common with Facebook), try best format
-                logger.warning(f"Format {format_spec} failed, retrying with best available format: {str(format_error)}")
-                ydl_opts['format'] = 'best'  # Fallback to best available
-                info = ydl.extract_info(video_url, download=True)
-        
-        # Get the downloaded filename from yt-dlp
-        filename = ydl.prepare_filename(info)
-        filepath = os.path.join(DOWNLOAD_DIR, filename)
+        loop = asyncio.get_running_loop()
+        filepath = await loop.run_in_executor(DOWNLOAD_POOL, run_download, video_url, ydl_opts, format_spec)
         
-        # Verify file exists after yt-dlp download
-        if not os.path.exists(filepath):
+        # Verify file exists after yt-dlp download and get its size with a single stat
+        try:
+            file_size = os.stat(filepath).st_size
+        except FileNotFoundError:
             logger.error(f"Downloaded file not found: {filepath}")
-            return jsonify({
+            return ORJSONResponse(status_code=400, content={
                 'error': 'download_failed',
                 'message': 'File was not created during download',
                 'code': 400
-            }), 400
+            })
         
         # Convert merged format if needed
-        if is_merge and not filename.lower().endswith(f'.{target_ext}'):
+        if is_merge and not filepath.lower().endswith(f'.{target_ext}'):
             logger.info(f"Converting merged output to .{target_ext}")
-            new_filename = filename.rsplit('.', 1)[0] + f'.{target_ext}'
-            new_filepath = os.path.join(DOWNLOAD_DIR, new_filename)
+            new_filepath = os.path.splitext(filepath)[0] + f'.{target_ext}'
             
-            try:
-                subprocess.run([
-                    'ffmpeg', '-i', filepath, '-c', 'copy', '-y', new_filepath
-                ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                os.remove(filepath)
-                filepath = new_filepath
-                filename = new_filename
-                logger.info(f"Conversion successful: {new_filename}")
-            except subprocess.CalledProcessError as e:
-                logger.warning(f"Conversion failed, keeping original: {str(e)}")
-        
-        # Now handle truncation and quality suffix
-        # Pre-truncate to account for quality suffix
-        if quality_suffix:
-            truncate_length = MAX_FILENAME_LENGTH - len(quality_suffix)
-            filename = truncate_filename(filename, truncate_length)
-            logger.debug(f"Pre-truncated filename to {truncate_length} chars")
-        else:
-            filename = truncate_filename(filename, MAX_FILENAME_LENGTH)
-            logger.debug(f"Truncated filename to {MAX_FILENAME_LENGTH} chars")
-        
-        # Add quality suffix if needed (single operation, no truncation)
-        if quality_suffix:
-            base_name, ext = os.path.splitext(filename)
-            new_filename = f"{base_name}{quality_suffix}{ext}"
-            new_filepath = os.path.join(DOWNLOAD_DIR, new_filename)
+            # Limit concurrent remuxes; other requests keep downloading meanwhile
+            async with FFMPEG_SEMAPHORE:
+                proc = await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-i', filepath, '-c', 'copy', '-y', new_filepath,
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+                )
+                returncode = await proc.wait()
             
-            try:
-                os.rename(filepath, new_filepath)
+            if returncode == 0:
+                os.remove(filepath)
                 filepath = new_filepath
-                filename = new_filename
-                logger.info(f"Renamed with quality suffix: {new_filename} (length: {len(new_filename)})")
-            except Exception as e:
-                logger.warning(f"Failed to rename: {str(e)}, keeping original filename")
-                # If rename fails, keep the original filepath and filename
-        
-        # Verify final file exists
-        if not os.path.exists(filepath):
-            logger.error(f"Final file not found: {filepath}")
-            return jsonify({
-                'error': 'download_failed',
-                'message': 'File was not found after processing',
-                'code': 400
-            }), 400
+                logger.info(f"Conversion successful: {new_filepath}")
+                
+                # The remuxed file replaced the download; stat it for the final size
+                try:
+                    file_size = os.stat(filepath).st_size
+                except FileNotFoundError:
+                    logger.error(f"Final file not found: {filepath}")
+                    return ORJSONResponse(status_code=400, content={
+                        'error': 'download_failed',
+                        'message': 'File was not found after processing',
+                        'code': 400
+                    })
+            else:
+                logger.warning(f"Conversion failed with exit code {returncode}, keeping original")
         
         # Check file size
-        file_size = os.path.getsize(filepath)
         if file_size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
             os.remove(filepath)
             logger.warning(f"File size exceeds limit: {file_size} bytes")
-            return jsonify({
+            return ORJSONResponse(status_code=400, content={
                 'error': 'file_too_large',
                 'message': f'File size exceeds maximum limit of {MAX_VIDEO_SIZE_MB}MB',
                 'code': 400
-            }), 400
+            })
         
         # Extract just the basename to send to Go backend (no directory path)
         download_filename = os.path.basename(filepath)
         
         logger.info(f"Download completed. File: {filepath}, Size: {file_size} bytes, Sending as: {download_filename}")
         
+        # Download directory is shared with the Go backend: let it pick the file up from disk
+        # (percent-encoded, since header values are latin-1 and titles are often not)
+        if USE_X_SENDFILE:
+            return Response(headers={'X-Sendfile': quote(os.path.abspath(filepath))})
+        
         # Send file to Golang backend with ONLY filename (no path)
-        return send_file(
+        # FileResponse streams from disk and sets ETag/Last-Modified from the file's stat
+        return VideoFileResponse(
             filepath,
-            as_attachment=True,
-            download_name=download_filename,  # ONLY basename, no path!
-            mimetype='application/octet-stream'
+            filename=download_filename,  # ONLY basename, no path!
+            media_type='application/octet-stream',
+            headers={'Cache-Control': 'private, no-cache'}
         )
             
-    except Exception as e:
-        logger.error(f"Download failed: {str(e)}")
-        return jsonify({
-            'error': 'download_failed',
-            'message': f"Download failed: {str(e)}",
+    except FileTooLargeError as e:
+        if e.partial_file and os.path.exists(e.partial_file):
+            os.remove(e.partial_file)
+        logger.warning(f"Download aborted, file size exceeds limit: {video_url}")
+        return ORJSONResponse(status_code=400, content={
+            'error': 'file_too_large',
+            'message': f'File size exceeds maximum limit of {MAX_VIDEO_SIZE_MB}MB',
             'code': 400
-        }), 400
-            
+        })
     except Exception as e:
         logger.error(f"Download failed: {str(e)}")
-        return jsonify({
+        return ORJSONResponse(status_code=400, content={
             'error': 'download_failed',
             'message': f"Download failed: {str(e)}",
             'code': 400
-        }), 400
+        })
+    finally:
+        DOWNLOAD_SLOTS.release()
 
 
-@app.errorhandler(413)
-def request_entity_too_large(error):
-    """Handle file too large error"""
-    logger.warning("Request entity too large")
-    return jsonify({
-        'error': 'request_too_large',
-        'message': f'File size exceeds maximum limit of {MAX_VIDEO_SIZE_MB}MB',
-        'code': 413
-    }), 413
+@app.exception_handler(RequestValidationError)
+async def invalid_request(request, exc):
+    """Handle malformed or incomplete request bodies"""
+    fields = ', '.join(str(err['loc'][-1]) for err in exc.errors())
+    logger.warning(f"Invalid request: {fields}")
+    return ORJSONResponse(status_code=400, content={
+        'error': 'invalid_request',
+        'message': f'Missing or invalid fields: {fields}',
+        'code': 400
+    })
 
 
-@app.errorhandler(500)
-def internal_error(error):
+@app.exception_handler(Exception)
+async def internal_error(request, error):
     """Handle internal server error"""
     logger.error(f"Internal server error: {error}")
-    return jsonify({
+    return ORJSONResponse(status_code=500, content={
         'error': 'server_error',
         'message': 'Internal server error',
         'code': 500
-    }), 500
+    })
 
 
 if __name__ == '__main__':
+    import uvicorn
+    
     port = int(os.getenv('PYTHON_WORKER_PORT', 5000))
     host = os.getenv('PYTHON_WORKER_HOST', '0.0.0.0')
     
     logger.info(f"Starting Python worker on {host}:{port}")
-    app.run(host=host, port=port, debug=False, threaded=True)
+    uvicorn.run(app, host=host, port=port)